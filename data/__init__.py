@@ -72,15 +72,27 @@ class CustomDatasetDataLoader():
         dataset_class = find_dataset_using_name(opt.dataset_mode)
         self.dataset = dataset_class(opt)
         print("dataset [%s] was created" % type(self.dataset).__name__)
+        if torch.distributed.is_available() and torch.distributed.is_initialized():
+            # one process per GPU: shard the dataset across ranks
+            self.sampler = torch.utils.data.distributed.DistributedSampler(self.dataset, shuffle=not opt.serial_batches)
+        else:
+            self.sampler = None
         self.dataloader = torch.utils.data.DataLoader(
             self.dataset,
             batch_size=opt.batch_size,
-            shuffle=not opt.serial_batches,
-            num_workers=int(opt.num_threads))
+            shuffle=(not opt.serial_batches) and self.sampler is None,
+            sampler=self.sampler,
+            num_workers=int(opt.num_threads),
+            pin_memory=torch.cuda.is_available())  # pinned batches allow non_blocking H2D copies in set_input
 
     def load_data(self):
         return self
 
+    def set_epoch(self, epoch):
+        """Reseed the distributed sampler so each epoch uses a different shard ordering"""
+        if self.sampler is not None:
+            self.sampler.set_epoch(epoch)
+
     def __len__(self):
         """Return the number of data in the dataset"""
         return min(len(self.dataset), self.opt.max_dataset_size)
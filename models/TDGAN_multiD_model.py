@@ -34,6 +34,8 @@ class TDGANMultiDModel(BaseModel):
         """
         # changing the default values to match the pix2pix paper (https://phillipi.github.io/pix2pix/)
         # parser.set_defaults(norm='batch', netG='unet_256', dataset_mode='aligned')
+        parser.add_argument('--compile_model', action='store_true', help='wrap the networks with torch.compile to fuse kernels and reduce per-op launch overhead')
+        parser.add_argument('--compile_mode', type=str, default='reduce-overhead', help='torch.compile mode [default | reduce-overhead | max-autotune]')
         if is_train:
             parser.set_defaults(pool_size=0, gan_mode='vanilla')
             parser.add_argument('--lambda_digesting_L1', type=float, default=100.0, help='weight for digesting L1 loss')
@@ -57,6 +59,10 @@ class TDGANMultiDModel(BaseModel):
             opt (Option class)-- stores all the experiment flags; needs to be a subclass of BaseOptions
         """
         BaseModel.__init__(self, opt)
+        # task_num is fixed for a run, so cache the current-task sample range once;
+        # previous-task samples occupy [0, self._cur_start)
+        self._cur_start = 2 * opt.task_num - 2
+        self._cur_end = 2 * opt.task_num
         if self.opt.task_num == 1 or self.opt.no_lifelong_training:
             self.loss_names = ['G_GAN_all', 'G_L1_all', 'G_perceptual_all', 'D_real_all', 'D_fake_all']
             self.visual_names = ['real_A_cur1', 'fake_B_cur1', 'real_B_cur1', 'real_A_cur2', 'fake_B_cur2', 'real_B_cur2']
@@ -76,46 +82,80 @@ class TDGANMultiDModel(BaseModel):
         self.netG_prev = networks.define_G(opt.input_nc, opt.output_nc, opt.ngf, opt.netG, opt.norm,
                                            not opt.no_dropout, opt.init_type, opt.init_gain, self.gpu_ids)
 
+        # NHWC layout lets cuDNN pick Tensor Core kernels for the 2D convs; purely a layout change
+        self.netG = self.netG.to(memory_format=torch.channels_last)
+        self.netG_prev = self.netG_prev.to(memory_format=torch.channels_last)
+
         if self.isTrain:  # define a discriminator; conditional GANs need to take both input and output images; Therefore, #channels for D is input_nc + output_nc
             self.netD = []
             for i in range(2):
                 self.netD.append(networks.define_D(opt.input_nc + opt.output_nc, opt.ndf, opt.netD,
-                                          opt.n_layers_D, opt.norm, opt.init_type, opt.init_gain, self.gpu_ids))
+                                          opt.n_layers_D, opt.norm, opt.init_type, opt.init_gain, self.gpu_ids).to(memory_format=torch.channels_last))
 
         if self.isTrain and self.opt.prev_model_path:
             self.load_prev_model()
 
+        # netG_prev only produces reminding targets; freeze it so no activations
+        # are stashed for backward and its outputs are deterministic
+        for param in self.netG_prev.parameters():
+            param.requires_grad_(False)
+        self.netG_prev.eval()
+
+        if torch.distributed.is_available() and torch.distributed.is_initialized():
+            # one process per GPU: re-wrap the trained nets for gradient all-reduce on backward.
+            # init_net already wrapped them in DataParallel, so unwrap first.
+            local_rank = self.gpu_ids[0]
+            self.netG = torch.nn.parallel.DistributedDataParallel(self.netG.module, device_ids=[local_rank])
+            if self.isTrain:
+                for i in range(len(self.netD)):
+                    self.netD[i] = torch.nn.parallel.DistributedDataParallel(self.netD[i].module, device_ids=[local_rank])
+            # netG_prev is frozen and the VGG feature net is never optimized, so neither needs DDP
+
         if self.isTrain:
             # define loss functions
             self.criterionGAN = networks.GANLoss(opt.gan_mode).to(self.device)
             self.criterionL1 = torch.nn.L1Loss()
             # initialize optimizers; schedulers will be automatically created by function <BaseModel.setup>.
-            self.optimizer_G = torch.optim.Adam(self.netG.parameters(), lr=opt.lr, betas=(opt.beta1, 0.999))
-            self.optimizer_D = []
-            for i in self.netD:
-                opt_D = torch.optim.Adam(i.parameters(), lr=opt.lr, betas=(opt.beta1, 0.999))
-                self.optimizer_D.append(opt_D)
-                self.optimizers.append(opt_D)
+            # fused Adam updates all parameters in one kernel; both discriminators share one optimizer
+            self.optimizer_G = torch.optim.Adam(self.netG.parameters(), lr=opt.lr, betas=(opt.beta1, 0.999), fused=True)
+            netD_params = list(self.netD[0].parameters()) + list(self.netD[1].parameters())
+            self.optimizer_D = torch.optim.Adam(netD_params, lr=opt.lr, betas=(opt.beta1, 0.999), fused=True)
+            self.optimizers.append(self.optimizer_D)
             self.optimizers.append(self.optimizer_G)
 
-            self.vgg_model = vgg16_feat().cuda()
+            self.vgg_model = vgg16_feat().to(self.device, memory_format=torch.channels_last)
             self.criterion_perceptual = perceptual_loss()
+            self.scaler = torch.cuda.amp.GradScaler()  # loss scaling for mixed-precision training
+            self._d_input_buf = [None, None]  # persistent stacked fake/real input buffer per discriminator
+
+        if opt.compile_model:  # input shapes are fixed (paired crops), so dynamic=False lets the compiler specialize kernels
+            # the per-step hot path is conv-bound (netG twice, each netD twice, VGG twice),
+            # so shape-specialized codegen pays off: TF32 matmuls for the remaining fp32 ops,
+            # and with --compile_mode max-autotune, Inductor additionally autotunes Triton
+            # kernels and replays the static-shape steps through CUDA graphs
+            torch.set_float32_matmul_precision('high')
+            if opt.compile_mode == 'max-autotune':
+                torch._inductor.config.triton.cudagraphs = True
+            self.netG = torch.compile(self.netG, mode=opt.compile_mode, dynamic=False)
+            self.netG_prev = torch.compile(self.netG_prev, mode='default', dynamic=False)  # only produces reminding targets; no gradients needed
+            if self.isTrain:
+                for i in range(len(self.netD)):
+                    self.netD[i] = torch.compile(self.netD[i], mode=opt.compile_mode, dynamic=False)
+                self.vgg_model = torch.compile(self.vgg_model, mode=opt.compile_mode, dynamic=False)
 
     def load_prev_model(self):
         """Load trained Generator using previous tasks
         """
-        nets = [self.netG_prev, self.netG]
-        model_paths = ['{:s}/{:d}_net_G.pth'.format(self.opt.prev_model_path, self.opt.prev_model_epoch),
-                       '{:s}/{:d}_net_G.pth'.format(self.opt.prev_model_path, self.opt.prev_model_epoch)]
-        for i in range(len(nets)):
-            net = nets[i]
-            path = model_paths[i]
+        path = '{:s}/{:d}_net_G.pth'.format(self.opt.prev_model_path, self.opt.prev_model_epoch)
+        print('loading the model from %s' % path)
+        # both generators start from the same checkpoint, so deserialize it once;
+        # mmap avoids materializing an extra CPU copy of the weights
+        state_dict = torch.load(path, map_location=self.device, mmap=True, weights_only=True)
+        if hasattr(state_dict, '_metadata'):
+            del state_dict._metadata
+        for net in [self.netG_prev, self.netG]:
             if isinstance(net, torch.nn.DataParallel):
                 net = net.module
-            print('loading the model from %s' % path)
-            state_dict = torch.load(path, map_location=self.device)
-            if hasattr(state_dict, '_metadata'):
-                del state_dict._metadata
             net.load_state_dict(state_dict)
 
     def toggle_dropout(self, activate=True):
@@ -139,15 +179,22 @@ class TDGANMultiDModel(BaseModel):
         self.real_A = []
         self.real_B = []
         self.image_paths = []
-        for i in range(self.opt.task_num * 2):
-            self.real_A.append(input['A_' + str(i)].to(self.device))
-            self.real_B.append(input['B_' + str(i)].to(self.device))
+        for i in range(self._cur_end):
+            # non_blocking overlaps the H2D copy with GPU compute; the dataloader pins its batches
+            self.real_A.append(input['A_' + str(i)].to(self.device, non_blocking=True).contiguous(memory_format=torch.channels_last))
+            self.real_B.append(input['B_' + str(i)].to(self.device, non_blocking=True).contiguous(memory_format=torch.channels_last))
             self.image_paths.append(input['A_paths_' + str(i)])
 
-        self.real_A_cur1 = self.real_A[2*self.opt.task_num-2]
-        self.real_A_cur2 = self.real_A[2*self.opt.task_num-1]
-        self.real_B_cur1 = self.real_B[2*self.opt.task_num-2]
-        self.real_B_cur2 = self.real_B[2*self.opt.task_num-1]
+        # stacked [N, B, C, H, W] views of the per-sample batches; the conditional
+        # real pairs consumed by backward_D are concatenated here once per step
+        self.real_A_all = torch.stack(self.real_A, dim=0)
+        self.real_B_all = torch.stack(self.real_B, dim=0)
+        self.real_AB = torch.cat([self.real_A_all, self.real_B_all], dim=2)
+
+        self.real_A_cur1 = self.real_A[self._cur_start]
+        self.real_A_cur2 = self.real_A[self._cur_start + 1]
+        self.real_B_cur1 = self.real_B[self._cur_start]
+        self.real_B_cur2 = self.real_B[self._cur_start + 1]
         if self.opt.task_num > 1 and (not self.opt.no_lifelong_training):
             self.real_A_prev1 = self.real_A[0]
             self.real_A_prev2 = self.real_A[1]
@@ -157,123 +204,130 @@ class TDGANMultiDModel(BaseModel):
     def forward(self):
         """Run forward pass; called by both functions <optimize_parameters> and <test>."""
         # self.toggle_dropout(True)
-        self.fake_B = []
-        for i in range(2*self.opt.task_num-2, 2*self.opt.task_num):
-            self.fake_B.append(self.netG(self.real_A[i]))  # for current task
-        self.fake_B_cur1 = self.fake_B[0]
-        self.fake_B_cur2 = self.fake_B[1]
-
-        # for previous task
-        if self.opt.task_num > 1 and (not self.opt.no_lifelong_training):
-            # self.toggle_dropout(False)
-            self.fake_B_curG = []
-            self.fake_B_prevG = []
-            for i in range(0, 2*self.opt.task_num-2):
-                self.fake_B_curG.append(self.netG(self.real_A[i]))
-                self.fake_B_prevG.append(self.netG_prev(self.real_A[i]))
-
-            self.fake_B_cur_prev1 = self.fake_B_curG[0]
-            self.fake_B_cur_prev2 = self.fake_B_curG[1]
-            self.fake_B_prev1 = self.fake_B_prevG[0]
-            self.fake_B_prev2 = self.fake_B_prevG[1]
+        with torch.autocast(device_type='cuda', dtype=torch.float16):
+            # batch the two current-task samples through a single netG call instead of two serial ones
+            real_A_cur = self.real_A_all[self._cur_start:self._cur_end].flatten(0, 1)
+            self.fake_B = list(self.netG(real_A_cur).chunk(2, dim=0))  # for current task
+            self.fake_B_cur1 = self.fake_B[0]
+            self.fake_B_cur2 = self.fake_B[1]
+
+            # for previous task
+            if self.opt.task_num > 1 and (not self.opt.no_lifelong_training):
+                # self.toggle_dropout(False)
+                # likewise run netG and netG_prev exactly once each over all previous-task samples
+                real_A_prev = self.real_A_all[0:self._cur_start].flatten(0, 1)
+                self.fake_B_curG = list(self.netG(real_A_prev).chunk(self._cur_start, dim=0))
+                with torch.no_grad():  # gradients never flow through the previous generator
+                    self.fake_B_prevG = list(self.netG_prev(real_A_prev).chunk(self._cur_start, dim=0))
+
+                self.fake_B_cur_prev1 = self.fake_B_curG[0]
+                self.fake_B_cur_prev2 = self.fake_B_curG[1]
+                self.fake_B_prev1 = self.fake_B_prevG[0]
+                self.fake_B_prev2 = self.fake_B_prevG[1]
 
     def backward_D(self):
         """Calculate GAN loss for the discriminator"""
 
         self.loss_D_fake = []
         self.loss_D_real = []
-        for i in range(2*self.opt.task_num-2, 2*self.opt.task_num):
-            # Fake; stop backprop to the generator by detaching fake_B
-            fake_AB = torch.cat((self.real_A[i], self.fake_B[i % 2]),1)  # we use conditional GANs; we need to feed both input and output to the discriminator
-            pred_fake = self.netD[i % 2](fake_AB.detach())
-            self.loss_D_fake.append(self.criterionGAN(pred_fake, False))
-            # Real
-            real_AB = torch.cat((self.real_A[i], self.real_B[i]), 1)
-            pred_real = self.netD[i % 2](real_AB)
-            self.loss_D_real.append(self.criterionGAN(pred_real, True))
-
-        self.loss_D_fake_all = None
-        self.loss_D_real_all = None
-        for i in range(len(self.loss_D_fake)):
-            if self.loss_D_fake_all is None:
-                self.loss_D_fake_all = self.loss_D_fake[i]
-                self.loss_D_real_all = self.loss_D_real[i]
-            else:
-                self.loss_D_fake_all += self.loss_D_fake[i]
-                self.loss_D_real_all += self.loss_D_real[i]
-
-        # combine loss and calculate gradients
-        self.loss_D = (self.loss_D_fake_all + self.loss_D_real_all)*self.opt.lambda_D #0.05
-        self.loss_D.backward()
+        with torch.autocast(device_type='cuda', dtype=torch.float16):
+            input_nc = self.opt.input_nc
+            for i in range(self._cur_start, self._cur_end):
+                # copy the stacked fake and real conditional pairs into a persistent
+                # per-discriminator buffer instead of allocating fresh cat results every
+                # step; the inputs carry no gradient (fake_B is detached), and each
+                # discriminator owns its buffer so the tensor a forward pass saved for
+                # backward is not overwritten within the same step
+                batch = self.real_A[i].size(0)
+                buf = self._d_input_buf[i % 2]
+                if buf is None or buf.size(0) != 2 * batch:
+                    buf = torch.empty(2 * batch, input_nc + self.opt.output_nc, *self.real_A[i].shape[2:],
+                                      device=self.device).contiguous(memory_format=torch.channels_last)
+                    self._d_input_buf[i % 2] = buf
+                # Fake; stop backprop to the generator by detaching fake_B. we use conditional GANs; we need to feed both input and output to the discriminator
+                buf[:batch, :input_nc].copy_(self.real_A[i])
+                buf[:batch, input_nc:].copy_(self.fake_B[i % 2].detach())
+                # Real; the conditional pair was precomputed in set_input
+                buf[batch:].copy_(self.real_AB[i])
+                # run the discriminator once over the stacked fake and real pairs
+                pred = self.netD[i % 2](buf)
+                pred_fake, pred_real = pred.chunk(2, dim=0)
+                self.loss_D_fake.append(self.criterionGAN(pred_fake, False))
+                self.loss_D_real.append(self.criterionGAN(pred_real, True))
+
+            self.loss_D_fake_all = torch.stack(self.loss_D_fake).sum()
+            self.loss_D_real_all = torch.stack(self.loss_D_real).sum()
+
+            # combine loss and calculate gradients
+            self.loss_D = (self.loss_D_fake_all + self.loss_D_real_all)*self.opt.lambda_D #0.05
+        self.scaler.scale(self.loss_D).backward()
 
     def backward_G(self):
         """Calculate GAN and L1 loss for the generator"""
         # ----- previous Ds are not available ----- #
         # for current task
         self.loss_G_GAN = []
-        self.loss_G_L1 = []
         self.loss_G_perceptual = []
-        for i in range(2 * self.opt.task_num - 2, 2 * self.opt.task_num):
-            fake_AB = torch.cat((self.real_A[i], self.fake_B[i % 2]), 1)
-            pred_fake = self.netD[i % 2](fake_AB)
-            self.loss_G_GAN.append(self.criterionGAN(pred_fake, True))
-            self.loss_G_L1.append(self.criterionL1(self.fake_B[i % 2], self.real_B[i]))
-            pred_feat = self.vgg_model(self.fake_B[i % 2])
-            target_feat = self.vgg_model(self.real_B[i])
-            self.loss_G_perceptual.append(self.criterion_perceptual(pred_feat, target_feat))
-
-        self.loss_G_GAN_all = None
-        self.loss_G_L1_all = None
-        self.loss_G_perceptual_all = None
-        for i in range(len(self.loss_G_GAN)):
-            if self.loss_G_GAN_all is None:
-                self.loss_G_GAN_all = self.loss_G_GAN[i]
-                self.loss_G_L1_all = self.loss_G_L1[i]
-                self.loss_G_perceptual_all = self.loss_G_perceptual[i]
+        with torch.autocast(device_type='cuda', dtype=torch.float16):
+            fake_B_cat = torch.cat(self.fake_B, dim=0)
+            real_B_cat = self.real_B_all[self._cur_start:self._cur_end].flatten(0, 1)
+            # one fused L1 over both samples; x2 restores the former sum of per-sample means
+            self.loss_G_L1_all = self.criterionL1(fake_B_cat, real_B_cat) * 2
+            # one VGG pass per side: the fakes need gradients, the real targets do not
+            vgg_feat_pred = self.vgg_model(fake_B_cat)
+            vgg_feat_pred = {key: feat.chunk(2, dim=0) for key, feat in vgg_feat_pred.items()}
+            with torch.no_grad():  # perceptual targets never receive gradients
+                vgg_feat_target = self.vgg_model(real_B_cat)
+            vgg_feat_target = {key: feat.chunk(2, dim=0) for key, feat in vgg_feat_target.items()}
+            for i in range(self._cur_start, self._cur_end):
+                fake_AB = torch.cat((self.real_A[i], self.fake_B[i % 2]), 1)
+                pred_fake = self.netD[i % 2](fake_AB)
+                self.loss_G_GAN.append(self.criterionGAN(pred_fake, True))
+                pred_feat = {key: feat[i % 2] for key, feat in vgg_feat_pred.items()}
+                target_feat = {key: feat[i % 2] for key, feat in vgg_feat_target.items()}
+                self.loss_G_perceptual.append(self.criterion_perceptual(pred_feat, target_feat))
+
+            self.loss_G_GAN_all = torch.stack(self.loss_G_GAN).sum()
+            self.loss_G_perceptual_all = torch.stack(self.loss_G_perceptual).sum()
+
+            # for previous tasks
+            if self.opt.task_num > 1 and (not self.opt.no_lifelong_training):
+                self.loss_reminding_perceptual = []
+                # likewise one batched VGG pass per side; previous-G fakes are distillation targets
+                n_prev = self._cur_start
+                fake_B_curG_cat = torch.cat(self.fake_B_curG, dim=0)
+                fake_B_prevG_cat = torch.cat(self.fake_B_prevG, dim=0)
+                self.loss_reminding_L1_all = self.criterionL1(fake_B_curG_cat, fake_B_prevG_cat) * n_prev
+                vgg_feat_cur = self.vgg_model(fake_B_curG_cat)
+                vgg_feat_cur = {key: feat.chunk(n_prev, dim=0) for key, feat in vgg_feat_cur.items()}
+                with torch.no_grad():
+                    vgg_feat_prev = self.vgg_model(fake_B_prevG_cat)
+                vgg_feat_prev = {key: feat.chunk(n_prev, dim=0) for key, feat in vgg_feat_prev.items()}
+                for i in range(0, n_prev):
+                    pred_feat_G = {key: feat[i] for key, feat in vgg_feat_cur.items()}
+                    pred_feat_G_prev = {key: feat[i] for key, feat in vgg_feat_prev.items()}
+                    self.loss_reminding_perceptual.append(self.criterion_perceptual(pred_feat_G, pred_feat_G_prev))
+
+                self.loss_reminding_perceptual_all = torch.stack(self.loss_reminding_perceptual).sum()
+
+            if self.opt.task_num == 1 or self.opt.no_lifelong_training:
+                self.loss_G = (self.loss_G_GAN_all + self.loss_G_L1_all * self.opt.lambda_digesting_L1 + self.loss_G_perceptual_all * self.opt.lambda_digesting_perceptual)*self.opt.lambda_G
             else:
-                self.loss_G_GAN_all += self.loss_G_GAN[i]
-                self.loss_G_L1_all += self.loss_G_L1[i]
-                self.loss_G_perceptual_all += self.loss_G_perceptual[i]
-
-        # for previous tasks
-        if self.opt.task_num > 1 and (not self.opt.no_lifelong_training):
-            self.loss_reminding_L1 = []
-            self.loss_reminding_perceptual = []
-            for i in range(0, 2 * self.opt.task_num - 2):
-                self.loss_reminding_L1.append(self.criterionL1(self.fake_B_curG[i], self.fake_B_prevG[i]))
-                pred_feat_G = self.vgg_model(self.fake_B_curG[i])
-                pred_feat_G_prev = self.vgg_model(self.fake_B_prevG[i])
-                self.loss_reminding_perceptual.append(self.criterion_perceptual(pred_feat_G, pred_feat_G_prev))
-
-            self.loss_reminding_L1_all = None
-            self.loss_reminding_perceptual_all = None
-            for i in range(len(self.loss_reminding_L1)):
-                if self.loss_reminding_L1_all is None:
-                    self.loss_reminding_L1_all = self.loss_reminding_L1[i]
-                    self.loss_reminding_perceptual_all = self.loss_reminding_perceptual[i]
-                else:
-                    self.loss_reminding_L1_all += self.loss_reminding_L1[i]
-                    self.loss_reminding_perceptual_all += self.loss_reminding_perceptual[i]
-
-        if self.opt.task_num == 1 or self.opt.no_lifelong_training:
-            self.loss_G = (self.loss_G_GAN_all + self.loss_G_L1_all * self.opt.lambda_digesting_L1 + self.loss_G_perceptual_all * self.opt.lambda_digesting_perceptual)*self.opt.lambda_G
-        else:
-            self.loss_G = (self.loss_G_GAN_all + self.loss_G_L1_all * self.opt.lambda_digesting_L1 + self.loss_G_perceptual_all * self.opt.lambda_digesting_perceptual
-                           + self.loss_reminding_L1_all * self.opt.lambda_reminding_L1 + self.loss_reminding_perceptual_all * self.opt.lambda_reminding_perceptual)*self.opt.lambda_G
-        self.loss_G.backward()
+                self.loss_G = (self.loss_G_GAN_all + self.loss_G_L1_all * self.opt.lambda_digesting_L1 + self.loss_G_perceptual_all * self.opt.lambda_digesting_perceptual
+                               + self.loss_reminding_L1_all * self.opt.lambda_reminding_L1 + self.loss_reminding_perceptual_all * self.opt.lambda_reminding_perceptual)*self.opt.lambda_G
+        self.scaler.scale(self.loss_G).backward()
 
     def optimize_parameters(self):
         self.forward()                   # compute fake images: G(A)
         # update D
         self.set_requires_grad(self.netD, True)  # enable backprop for D
-        for opt in self.optimizer_D:
-            opt.zero_grad()
+        self.optimizer_D.zero_grad(set_to_none=True)
         self.backward_D()
-        for opt in self.optimizer_D:
-            opt.step()
+        self.scaler.step(self.optimizer_D)
 
         self.set_requires_grad(self.netD, False)  # D requires no gradients when optimizing G
-        self.optimizer_G.zero_grad()        # set G's gradients to zero
+        self.optimizer_G.zero_grad(set_to_none=True)  # free G's gradients instead of zeroing them
         self.backward_G()                   # calculate graidents for G
-        self.optimizer_G.step()             # udpate G's weights
+        self.scaler.step(self.optimizer_G)  # udpate G's weights
+        self.scaler.update()
 
@@ -212,7 +212,9 @@ class BaseModel(ABC):
                 load_filename = '%s_net_%s.pth' % (epoch, name)
                 load_path = os.path.join(self.save_dir, load_filename)
                 net = getattr(self, 'net' + name)
-                if isinstance(net, torch.nn.DataParallel):
+                if hasattr(net, '_orig_mod'):  # unwrap torch.compile so state dict keys match
+                    net = net._orig_mod
+                if isinstance(net, (torch.nn.DataParallel, torch.nn.parallel.DistributedDataParallel)):
                     net = net.module
                 print('loading the model from %s' % load_path)
                 # if you are using PyTorch newer than 0.4 (e.g., built from
@@ -1,5 +1,6 @@
 import torch
 from torch import nn
+from torch.utils.checkpoint import checkpoint
 from torchvision import models
 
 
@@ -13,13 +14,26 @@ class vgg16_feat(nn.Module):
             '15': "relu3_3",
             '22': "relu4_3"
         }
+        # split the conv stack into one block per tapped feature map, so each block
+        # can be gradient-checkpointed; layers after the last tap are never needed
+        self._blocks = []
+        block = []
+        for name, module in self.vgg_layers._modules.items():
+            block.append(module)
+            if name in self.layer_name_mapping:
+                self._blocks.append((self.layer_name_mapping[name], nn.Sequential(*block)))
+                block = []
 
     def forward(self, x):
         output = {}
-        for name, module in self.vgg_layers._modules.items():
-            x = module(x)
-            if name in self.layer_name_mapping:
-                output[self.layer_name_mapping[name]] = x
+        for feat_name, block in self._blocks:
+            if torch.is_grad_enabled() and x.requires_grad:
+                # keep only the block boundaries alive and recompute the intermediate
+                # activations in backward, trading FLOPs for activation memory
+                x = checkpoint(block, x, use_reentrant=False)
+            else:
+                x = block(x)
+            output[feat_name] = x
         return output
 
 
@@ -41,4 +55,4 @@ class perceptual_loss(nn.Module):
             loss += ((x1_feat[key] - x2_feat[key]) ** 2).sum() / (size[0] * size[1] * size[2] * size[3])
 
         loss /= 4
-        return loss
\ No newline at end of file
+        return loss